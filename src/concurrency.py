@@ -0,0 +1,28 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+def with_script_ctx(func: Callable) -> Callable:
+    """Wrap func so it runs attached to the current Streamlit script run
+
+    Worker threads start without a script context, so st.error and friends
+    called from them would not reach the page.
+    """
+    ctx = get_script_run_ctx()
+
+    def call(*args: Any) -> Any:
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return func(*args)
+
+    return call
+
+@st.cache_resource
+def get_executor() -> ThreadPoolExecutor:
+    """Create a thread pool shared across reruns and sessions"""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="sql-assistant")
+
+def submit(func: Callable, *args: Any) -> Future:
+    """Run a blocking call on the shared pool, attached to this script run"""
+    return get_executor().submit(with_script_ctx(func), *args)
@@ -1,16 +1,83 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg
+from psycopg import sql
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool, PoolTimeout
+from contextlib import contextmanager
+from itertools import groupby, islice
 import streamlit as st
-from typing import List, Tuple, Dict, Optional
+from typing import Iterator, List, Tuple, Dict, Optional
 
-def get_database_connection():
-    """Create database connection using Streamlit secrets"""
+# Seconds to keep introspected schema before querying the catalog again
+SCHEMA_CACHE_TTL = 300
+
+# Seconds to keep sidebar statistics and sample rows between reruns
+SIDEBAR_CACHE_TTL = 600
+
+# Most rows a generated query may pull into memory, and rows per server fetch
+MAX_RESULT_ROWS = 10_000
+RESULT_FETCH_SIZE = 1_000
+
+# Statements that can run through a server-side cursor
+_STREAMABLE_PREFIXES = ("select", "with", "values", "table")
+
+# Seconds to wait for a connection before reporting the database unreachable
+CONNECT_TIMEOUT = 5
+
+@st.cache_resource
+def get_pool() -> ConnectionPool:
+    """Create a connection pool shared across reruns and sessions"""
+    return ConnectionPool(
+        st.secrets["DATABASE_URL"],
+        min_size=1,
+        max_size=8,
+        # Prepare server-side from the second run of a statement, so the
+        # repeated schema queries skip parse/plan on later reruns
+        kwargs={"prepare_threshold": 1, "connect_timeout": CONNECT_TIMEOUT},
+        # Fail fast on a bad URL or unreachable server instead of the
+        # default 30 second wait in getconn()
+        timeout=CONNECT_TIMEOUT,
+        open=True,
+    )
+
+def _release(pool: ConnectionPool, conn: psycopg.Connection) -> None:
+    """Return a connection to the pool after discarding any open transaction"""
+    try:
+        conn.rollback()
+    except psycopg.Error:
+        pass
+    pool.putconn(conn)
+
+@contextmanager
+def get_database_connection() -> Iterator[Optional[psycopg.Connection]]:
+    """Borrow a pooled database connection using Streamlit secrets"""
     try:
-        conn = psycopg2.connect(st.secrets["DATABASE_URL"])
-        return conn
+        pool = get_pool()
+        conn = pool.getconn()
     except Exception as e:
         st.error(f"Error connecting to database: {e}")
-        return None
+        yield None
+        return
+
+    try:
+        yield conn
+    finally:
+        # Discard any open transaction so the next borrower starts clean
+        _release(pool, conn)
+
+@contextmanager
+def _connection() -> Iterator[psycopg.Connection]:
+    """Borrow a pooled connection, raising instead of reporting on failure
+
+    Used by the cached helpers: st.cache_data does not store a call that
+    raises, so a failed lookup is retried on the next rerun instead of being
+    replayed for the whole TTL.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        _release(pool, conn)
 
 def get_database_name() -> str:
     """Get the display name for the database"""
@@ -19,185 +86,287 @@ def get_database_name() -> str:
     except:
         return "Database"  # fallback name
     
+@st.cache_data(ttl=SCHEMA_CACHE_TTL)
+def _fetch_all_tables() -> List[str]:
+    with _connection() as conn, conn.cursor() as cur:
+        # Query to get all tables
+        cur.execute("""
+            SELECT table_name 
+            FROM information_schema.tables 
+            WHERE table_schema = 'public'
+            AND table_type = 'BASE TABLE'
+            ORDER BY table_name;
+        """)
+        return [row[0] for row in cur.fetchall()]
+
 def get_all_tables() -> List[str]:
     """Get list of all tables in the database"""
-    conn = get_database_connection()
-    if not conn:
-        return []
-    
     try:
-        with conn.cursor() as cur:
-            # Query to get all tables
-            cur.execute("""
-                SELECT table_name 
-                FROM information_schema.tables 
-                WHERE table_schema = 'public'
-                AND table_type = 'BASE TABLE'
-                ORDER BY table_name;
-            """)
-            tables = [row[0] for row in cur.fetchall()]
-        return tables
+        return _fetch_all_tables()
     except Exception as e:
         st.error(f"Error fetching tables: {e}")
         return []
-    finally:
-        conn.close()
+
+@st.cache_data(ttl=SCHEMA_CACHE_TTL)
+def _fetch_table_schema(table_name: str) -> List[Tuple]:
+    with _connection() as conn, conn.cursor() as cur:
+        # Query to get column information
+        cur.execute("""
+            SELECT 
+                column_name,
+                data_type,
+                is_nullable,
+                column_default
+            FROM information_schema.columns
+            WHERE table_name = %s
+            AND table_schema = 'public'
+            ORDER BY ordinal_position;
+        """, (table_name,))
+        return cur.fetchall()
 
 def get_table_schema(table_name: str) -> List[Tuple]:
     """Get schema information for a specific table"""
-    conn = get_database_connection()
-    if not conn:
-        return []
-    
     try:
-        with conn.cursor() as cur:
-            # Query to get column information
-            cur.execute("""
-                SELECT 
-                    column_name,
-                    data_type,
-                    is_nullable,
-                    column_default
-                FROM information_schema.columns
-                WHERE table_name = %s
-                AND table_schema = 'public'
-                ORDER BY ordinal_position;
-            """, (table_name,))
-            columns = cur.fetchall()
-        return columns
+        return _fetch_table_schema(table_name)
     except Exception as e:
         st.error(f"Error fetching schema for {table_name}: {e}")
         return []
-    finally:
-        conn.close()
+
+@st.cache_data(ttl=SCHEMA_CACHE_TTL)
+def _fetch_all_columns() -> Dict[str, List[Tuple]]:
+    with _connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT 
+                table_name,
+                column_name,
+                data_type,
+                is_nullable,
+                column_default
+            FROM information_schema.columns
+            WHERE table_schema = 'public'
+            ORDER BY table_name, ordinal_position;
+        """)
+        rows = cur.fetchall()
+    return {
+        table: [row[1:] for row in table_rows]
+        for table, table_rows in groupby(rows, key=lambda row: row[0])
+    }
+
+def get_all_columns() -> Dict[str, List[Tuple]]:
+    """Get schema information for every table in a single query
+
+    Returns:
+        Dict[str, List[Tuple]]: Table name mapped to the same column tuples
+            returned by get_table_schema
+    """
+    try:
+        return _fetch_all_columns()
+    except Exception as e:
+        st.error(f"Error fetching columns: {e}")
+        return {}
+
+@st.cache_data(ttl=SCHEMA_CACHE_TTL)
+def _fetch_table_relationships() -> List[Tuple]:
+    with _connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            -- Read pg_catalog directly; the information_schema views
+            -- layer many joins and privilege checks on top of it
+            SELECT
+                n.nspname AS table_schema,
+                cl.relname AS table_name,
+                att.attname AS column_name,
+                nf.nspname AS foreign_table_schema,
+                clf.relname AS foreign_table_name,
+                attf.attname AS foreign_column_name
+            FROM pg_constraint AS c
+                CROSS JOIN LATERAL unnest(c.conkey, c.confkey) AS k(attnum, fattnum)
+                JOIN pg_class AS cl ON cl.oid = c.conrelid
+                JOIN pg_namespace AS n ON n.oid = cl.relnamespace
+                JOIN pg_class AS clf ON clf.oid = c.confrelid
+                JOIN pg_namespace AS nf ON nf.oid = clf.relnamespace
+                JOIN pg_attribute AS att
+                  ON att.attrelid = c.conrelid AND att.attnum = k.attnum
+                JOIN pg_attribute AS attf
+                  ON attf.attrelid = c.confrelid AND attf.attnum = k.fattnum
+            WHERE c.contype = 'f'
+            AND n.nspname = 'public'
+            ORDER BY cl.relname;
+        """)
+        return cur.fetchall()
 
 def get_table_relationships() -> List[Tuple]:
     """Get foreign key relationships between tables"""
-    conn = get_database_connection()
-    if not conn:
-        return []
-    
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT
-                    tc.table_schema, 
-                    tc.table_name, 
-                    kcu.column_name,
-                    ccu.table_schema AS foreign_table_schema,
-                    ccu.table_name AS foreign_table_name,
-                    ccu.column_name AS foreign_column_name
-                FROM 
-                    information_schema.table_constraints AS tc 
-                    JOIN information_schema.key_column_usage AS kcu
-                      ON tc.constraint_name = kcu.constraint_name
-                      AND tc.table_schema = kcu.table_schema
-                    JOIN information_schema.constraint_column_usage AS ccu
-                      ON ccu.constraint_name = tc.constraint_name
-                      AND ccu.table_schema = tc.table_schema
-                WHERE tc.constraint_type = 'FOREIGN KEY'
-                ORDER BY tc.table_name;
-            """)
-            relationships = cur.fetchall()
-        return relationships
+        return _fetch_table_relationships()
     except Exception as e:
         st.error(f"Error fetching relationships: {e}")
         return []
-    finally:
-        conn.close()
 
-def get_database_stats() -> Optional[Dict]:
-    """Get database statistics"""
-    conn = get_database_connection()
-    if not conn:
-        return None
-    
-    try:
-        with conn.cursor() as cur:
-            # Get database size
-            cur.execute("""
-                SELECT pg_size_pretty(pg_database_size(current_database())) as db_size;
-            """)
-            db_size = cur.fetchone()[0]
-            
-            # Get number of tables
-            cur.execute("""
-                SELECT COUNT(*) 
+@st.cache_data(ttl=SIDEBAR_CACHE_TTL, show_spinner=False)
+def _fetch_database_stats() -> Dict:
+    with _connection() as conn, conn.cursor() as cur:
+        # Size, table count and row estimate in a single round trip
+        cur.execute("""
+            WITH db AS (
+                SELECT pg_size_pretty(pg_database_size(current_database())) AS db_size
+            ),
+            table_total AS (
+                SELECT COUNT(*) AS table_count
                 FROM information_schema.tables 
                 WHERE table_schema = 'public'
-                AND table_type = 'BASE TABLE';
-            """)
-            table_count = cur.fetchone()[0]
-            
-            # Get row counts for each table
-            total_rows = 0
-            tables = get_all_tables()
-            for table in tables:
-                try:
-                    cur.execute(f'SELECT COUNT(*) FROM "{table}";')
-                    count = cur.fetchone()[0]
-                    total_rows += count if count else 0
-                except Exception as e:
-                    st.warning(f"Couldn't count rows in {table}: {e}")
-            
-            return {
-                "size": db_size,
-                "tables": table_count,
-                "total_rows": total_rows
-            }
+                AND table_type = 'BASE TABLE'
+            ),
+            row_estimate AS (
+                -- Planner statistics instead of COUNT(*) on every table
+                SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint AS total_rows
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'public'
+                AND c.relkind = 'r'
+            )
+            SELECT db.db_size, table_total.table_count, row_estimate.total_rows
+            FROM db, table_total, row_estimate;
+        """)
+        db_size, table_count, total_rows = cur.fetchone()
+
+    return {
+        "size": db_size,
+        "tables": table_count,
+        "total_rows": total_rows
+    }
+
+def get_database_stats() -> Optional[Dict]:
+    """Get database statistics
+
+    The row total is the planner's estimate from pg_class.reltuples, which
+    is kept current by ANALYZE/autovacuum rather than counted exactly.
+    """
+    try:
+        return _fetch_database_stats()
     except Exception as e:
         st.error(f"Error fetching database stats: {e}")
         return None
-    finally:
-        conn.close()
 
-def execute_sql_query(query: str) -> Tuple[List[Dict], List[str]]:
+def execute_sql_query(query: str, max_rows: int = MAX_RESULT_ROWS) -> Tuple[List[Dict], List[str], bool]:
     """Execute a SQL query and return results with column names
+
+    Single SELECT-style queries are streamed through a server-side cursor;
+    anything else (data changes, several statements) runs on a plain cursor.
+    Either way at most max_rows are kept, so a huge result never has to be
+    held in memory at once.
     
     Args:
         query (str): SQL query to execute
+        max_rows (int): Maximum number of rows to return
         
     Returns:
-        Tuple[List[Dict], List[str]]: Tuple containing:
+        Tuple[List[Dict], List[str], bool]: Tuple containing:
             - List of result rows as dictionaries
             - List of column names
+            - Whether rows past max_rows were dropped
     """
-    conn = get_database_connection()
-    if not conn:
-        return [], []
-    
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query)
-            results = cur.fetchall()
-            
-            # Get column names from cursor description
-            columns = [desc[0] for desc in cur.description] if cur.description else []
-            
-            return list(results), columns
-            
-    except Exception as e:
-        st.error(f"Error executing query: {e}")
-        return [], []
-    finally:
-        conn.close()
+    with get_database_connection() as conn:
+        if not conn:
+            return [], [], False
+
+        try:
+            # DECLARE ... CURSOR FOR only takes one SELECT/VALUES statement
+            # without its terminator
+            body = query.strip().rstrip(";").rstrip()
+            streamable = ";" not in body and body.lower().startswith(_STREAMABLE_PREFIXES)
+
+            if streamable:
+                cur = conn.cursor(name="sql_query_assistant", row_factory=dict_row)
+                cur.itersize = RESULT_FETCH_SIZE
+                query = body
+            else:
+                cur = conn.cursor(row_factory=dict_row)
+
+            with cur:
+                cur.execute(query)
+                results = []
+                truncated = False
+                if cur.description:
+                    # Read one extra row to tell whether the result was cut off
+                    results = list(islice(cur, max_rows + 1))
+                    truncated = len(results) > max_rows
+                    if truncated:
+                        results.pop()
+                        st.warning(f"Query returned more than {max_rows:,} rows; showing the first {max_rows:,}.")
+
+                # Get column names from cursor description
+                columns = [desc.name for desc in cur.description] if cur.description else []
+
+                return results, columns, truncated
+
+        except Exception as e:
+            st.error(f"Error executing query: {e}")
+            return [], [], False
+
+def _preview_query(table_name: str) -> sql.Composed:
+    """Build the preview query with the table name quoted as an identifier"""
+    return sql.SQL("SELECT * FROM {} LIMIT %s;").format(sql.Identifier(table_name))
+
+@st.cache_data(ttl=SIDEBAR_CACHE_TTL, show_spinner=False)
+def _fetch_table_preview(table_name: str, limit: int) -> List[Dict]:
+    with _connection() as conn, conn.cursor(row_factory=dict_row) as cur:
+        cur.execute(_preview_query(table_name), (limit,))
+        return cur.fetchall()
 
 def get_table_preview(table_name: str, limit: int = 5) -> List[Dict]:
     """Get preview rows from a table"""
-    conn = get_database_connection()
-    if not conn:
-        return []
-    
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(f'SELECT * FROM "{table_name}" LIMIT %s;', (limit,))
-            preview = cur.fetchall()
-        return preview
+        return _fetch_table_preview(table_name, limit)
     except Exception as e:
         st.error(f"Error fetching preview for {table_name}: {e}")
         return []
-    finally:
-        conn.close()
+
+@st.cache_data(ttl=SIDEBAR_CACHE_TTL, show_spinner=False)
+def _fetch_previews(tables: List[str], limit: int) -> Dict[str, List[Dict]]:
+    with _connection() as conn:
+        cursors = {}
+        with conn.pipeline():
+            for table in tables:
+                cur = conn.cursor(row_factory=dict_row)
+                cur.execute(_preview_query(table), (limit,))
+                cursors[table] = cur
+        # Leaving the pipeline block syncs and collects every result
+        previews = {table: cur.fetchall() for table, cur in cursors.items()}
+        for cur in cursors.values():
+            cur.close()
+    return previews
+
+def get_previews(tables: List[str], limit: int = 5) -> Dict[str, List[Dict]]:
+    """Get preview rows for several tables in one round trip
+
+    The per-table queries are sent together in pipeline mode over a single
+    pooled connection instead of one connection and round trip per table.
+    If any table fails, the rest of the pipeline is aborted with it, so the
+    tables are then fetched one by one and only the failing ones are lost.
+    """
+    if not tables:
+        return {}
+
+    try:
+        return _fetch_previews(tables, limit)
+    except PoolTimeout as e:
+        st.error(f"Error connecting to database: {e}")
+        return {}
+    except psycopg.Error:
+        return {table: get_table_preview(table, limit) for table in tables}
+    except Exception as e:
+        st.error(f"Error fetching previews: {e}")
+        return {}
+
+def clear_schema_cache() -> None:
+    """Drop cached schema, stats and samples so outside changes show up"""
+    _fetch_all_tables.clear()
+    _fetch_table_schema.clear()
+    _fetch_all_columns.clear()
+    _fetch_table_relationships.clear()
+    _fetch_database_stats.clear()
+    _fetch_table_preview.clear()
+    _fetch_previews.clear()
 
 def test_database_connection() -> bool:
     """Test database connection and print schema information"""
@@ -1,49 +1,35 @@
 import re
-from typing import Tuple, List, Dict, Optional
-from groq import Groq
+import time
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Callable, Tuple, List, Dict, Optional
+from groq import AsyncGroq
 import streamlit as st
-from .database import get_all_tables, get_table_schema, get_database_connection, get_database_name
+from .concurrency import with_script_ctx
+from .database import get_all_tables, get_all_columns, get_table_relationships, execute_sql_query
 
-def get_db_schema_context() -> str:
-    """Generate database schema context for the LLM"""
-    context = ["Database Schema:"]
-    
-    tables = get_all_tables()
-    for table in tables:
-        context.append(f"\nTable: {table}")
-        columns = get_table_schema(table)
-        for col in columns:
-            col_name, col_type, is_nullable, default = col
-            nullable_text = "NULL" if is_nullable == "YES" else "NOT NULL"
-            context.append(f"  - {col_name} ({col_type}) {nullable_text}")
-    
-    return "\n".join(context)
+# Seconds to reuse generated SQL and answers for a repeated question
+RESPONSE_CACHE_TTL = 3600
 
-def sanitize_sql(query: str) -> str:
-    """Remove Markdown formatting and backticks from SQL query"""
-    # Remove code block markers
-    query = re.sub(r'```sql', '', query, flags=re.IGNORECASE)
-    query = re.sub(r'```', '', query)
-    
-    # Remove leading/trailing whitespace and quotes
-    query = query.strip().strip('"').strip("'")
-    
-    # Ensure semicolon at end
-    if not query.endswith(';'):
-        query += ';'
-        
-    return query
+# Most questions kept per cache bucket; answers hold full result rows
+RESPONSE_CACHE_MAX_ENTRIES = 50
 
-def generate_sql_query(question: str, schema_context: str) -> str:
-    """Generate SQL query using Groq"""
-    client = Groq(api_key=st.secrets["GROQ_API_KEY"])
-    
-    prompt = f"""Given this database schema:
-{schema_context}
+# Filler words that change the phrasing of a question but not what it asks
+# for; prepositions and conjunctions stay, since they pick filters, groupings
+# and joins ("revenue by region" vs "revenue in region")
+_STOPWORDS = frozenset({
+    "a", "an", "the", "me", "us", "please", "show", "list", "give", "display",
+    "get", "find", "tell", "what", "is", "are", "can", "could", "you", "i",
+    "want", "see", "let",
+})
 
-Generate a SQL query for: {question}
+# Compiled once at import; these run on every question
+_RE_FENCE = re.compile(r'```sql\s*|\s*```', re.IGNORECASE)
+_RE_NON_WORD = re.compile(r'\W+')
 
-Follow these strict rules:
+# Fixed instructions sent as the system message so only the schema and the
+# question change between SQL generation requests
+SQL_SYSTEM_RULES = """Follow these strict rules:
 1. Identifier Handling:
    - Only quote identifiers with spaces/special characters using standard double quotes
    - Never nest quotes or use backslash escaping
@@ -92,72 +78,156 @@ WHERE c.region = 'West'
 ORDER BY o.order_date DESC
 LIMIT 10;"""
 
-    response = client.chat.completions.create(
-        messages=[{
-            "role": "user",
-            "content": prompt
-        }],
-        model="llama-3.3-70b-versatile",
-        temperature=0.1,
-        max_tokens=500
-    )
-    raw_sql = response.choices[0].message.content.strip()
-    return sanitize_sql(raw_sql)
+async def run_in_thread(func: Callable, *args: Any) -> Any:
+    """Run a blocking call in a worker thread without blocking the event loop
 
-# def generate_sql_query(question: str, schema_context: str) -> str:
-#     """Generate SQL query using Groq"""
-#     client = Groq(api_key=st.secrets["GROQ_API_KEY"])
+    The worker is attached to the current script run so st.error and friends
+    called inside func still reach the page.
+    """
+    return await asyncio.to_thread(with_script_ctx(func), *args)
+
+def build_schema_context(tables: List[str], all_columns: Dict[str, List[Tuple]], relationships: List[Tuple]) -> str:
+    """Generate database schema context for the LLM"""
+    context = ["Database Schema:"]
     
-#     prompt = f"""Given the following database schema:
+    for table in tables:
+        context.append(f"\nTable: {table}")
+        # Names and types are all the model needs to write a query
+        for col_name, col_type, *_ in all_columns.get(table, []):
+            context.append(f"  - {col_name} ({col_type})")
+    
+    # Foreign keys tell the model which columns to join on
+    if relationships:
+        context.append("\nRelationships:")
+        for rel in relationships:
+            context.append(f"  - {rel[1]}.{rel[2]} -> {rel[4]}.{rel[5]}")
+    
+    return "\n".join(context)
 
-# {schema_context}
+async def get_db_schema_context() -> str:
+    """Load the schema metadata concurrently and build the LLM schema context
 
-# Generate a SQL query to answer this question: {question}
+    Each lookup borrows its own pooled connection, so a cold load costs the
+    slowest of the three queries rather than their sum. Warm loads are
+    served from the st.cache_data caches in the database module.
+    """
+    tables, all_columns, relationships = await asyncio.gather(
+        run_in_thread(get_all_tables),
+        run_in_thread(get_all_columns),
+        run_in_thread(get_table_relationships),
+    )
+    return build_schema_context(tables, all_columns, relationships)
 
-# Important rules for the SQL query:
-# 1. Use double quotes for table aliases and column names
-# 2. For column names containing spaces, just use double quotes, no special escaping needed
-# 3. The query must be compatible with PostgreSQL
-# 4. Don't use quotes within quotes for column names
+def get_groq() -> AsyncGroq:
+    """Create the Groq client shared by every LLM call for one question
 
-# Return ONLY the SQL query, nothing else."""
+    The client is not kept across reruns: its async HTTP connection pool
+    belongs to the event loop of the asyncio.run() call that created it.
+    """
+    return AsyncGroq(api_key=st.secrets["GROQ_API_KEY"])
 
-#     response = client.chat.completions.create(
-#         messages=[{
-#             "role": "user",
-#             "content": prompt
-#         }],
-#         model="llama-3.3-70b-versatile",  # or your preferred Groq model
-#         temperature=0.1,
-#         max_tokens=500
-#     )
-    
-#     return response.choices[0].message.content.strip()
+def _canonicalize(question: str) -> str:
+    """Normalize case, punctuation and spacing so rewordings share a cache key"""
+    return _RE_NON_WORD.sub(' ', question.lower()).strip()
 
-def execute_query(query: str) -> List[Dict]:
-    """Execute SQL query and return results"""
-    conn = get_database_connection()
-    if not conn:
-        return []
-    
-    try:
-        with conn.cursor() as cur:
-            cur.execute(query)
-            columns = [desc[0] for desc in cur.description]
-            results = []
-            for row in cur.fetchall():
-                results.append(dict(zip(columns, row)))
-            return results
-    except Exception as e:
-        st.error(f"Error executing query: {e}")
-        return []
-    finally:
-        conn.close()
+def _question_terms(canonical: str) -> Tuple[str, ...]:
+    """The meaningful words of a canonical question, in order
+
+    Order is kept because it carries meaning: "from Boston to Denver" and
+    "from Denver to Boston" use the same words but ask different things.
+    """
+    return tuple(word for word in canonical.split() if word not in _STOPWORDS)
 
-def generate_nl_response(question: str, query: str, results: List[Dict]) -> str:
-    """Generate natural language response using Groq"""
-    client = Groq(api_key=st.secrets["GROQ_API_KEY"])
+@st.cache_resource
+def _response_cache() -> Dict[str, Dict]:
+    """Process-wide store of generated SQL and full answers"""
+    return {"sql": {}, "answers": {}}
+
+def _cache_get(bucket: str, key: Tuple[str, str]) -> Optional[Any]:
+    """Return a cached value if it has not expired"""
+    entry = _response_cache()[bucket].get(key)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+def _cache_put(bucket: str, key: Tuple[str, str], value: Any) -> None:
+    """Store a value for RESPONSE_CACHE_TTL seconds, evicting expired entries
+
+    At most RESPONSE_CACHE_MAX_ENTRIES are kept; the oldest go first.
+    """
+    now = time.monotonic()
+    store = _response_cache()[bucket]
+    for stale, (expires, _) in list(store.items()):
+        if expires <= now:
+            store.pop(stale, None)
+    # Re-insert so dict order stays oldest first
+    store.pop(key, None)
+    while len(store) >= RESPONSE_CACHE_MAX_ENTRIES:
+        store.pop(next(iter(store)), None)
+    store[key] = (now + RESPONSE_CACHE_TTL, value)
+
+def _similar_answer(key: Tuple[str, str]) -> Optional[Tuple[str, Any]]:
+    """Find a cached answer to a rewording of a question
+
+    A rewording differs only in filler words; its meaningful words must
+    match in the same order. Only answers for the same schema count.
+
+    Returns:
+        Optional[Tuple[str, Any]]: The cached question and its answer
+    """
+    question, schema_hash = key
+    terms = _question_terms(question)
+    if not terms:
+        return None
+
+    now = time.monotonic()
+    for (cached_question, cached_schema), (expires, value) in list(_response_cache()["answers"].items()):
+        if cached_schema == schema_hash and expires > now and _question_terms(cached_question) == terms:
+            return cached_question, value
+    return None
+
+def clear_response_cache() -> None:
+    """Forget cached answers so the next question re-runs its SQL and summary
+
+    Generated SQL is kept; it only depends on the question and the schema.
+    """
+    _response_cache()["answers"].clear()
+
+def sanitize_sql(query: str) -> str:
+    """Remove Markdown formatting and backticks from SQL query"""
+    # Remove code block markers
+    query = _RE_FENCE.sub('', query)
+    
+    # Remove leading/trailing whitespace and quotes
+    query = query.strip().strip('"').strip("'")
     
+    # Ensure semicolon at end
+    if not query.endswith(';'):
+        query += ';'
+        
+    return query
+
+async def generate_sql_query(client: AsyncGroq, question: str, schema_context: str) -> str:
+    """Generate SQL query using Groq"""
+    prompt = f"""Given this database schema:
+{schema_context}
+
+Generate a SQL query for: {question}"""
+
+    response = await client.chat.completions.create(
+        messages=[
+            {"role": "system", "content": SQL_SYSTEM_RULES},
+            {"role": "user", "content": prompt},
+        ],
+        model="llama-3.3-70b-versatile",
+        temperature=0.1,
+        max_tokens=500
+    )
+    raw_sql = response.choices[0].message.content.strip()
+    return sanitize_sql(raw_sql)
+
+async def stream_nl_response(client: AsyncGroq, question: str, query: str, results: List[Dict]) -> AsyncIterator[str]:
+    """Generate natural language response using Groq, yielding text as it arrives"""
     # Convert results to string representation
     results_str = "\n".join([str(row) for row in results[:5]])
     if len(results) > 5:
@@ -173,35 +243,85 @@ Query Results:
 
 Please provide a clear, natural language response that answers the original question based on these results. Keep it concise but informative."""
 
-    response = client.chat.completions.create(
+    stream = await client.chat.completions.create(
         messages=[{
             "role": "user",
             "content": prompt
         }],
         model="llama-3.3-70b-versatile",  # or your preferred Groq model
         temperature=0.7,
-        max_tokens=200
+        max_tokens=200,
+        stream=True
     )
     
-    return response.choices[0].message.content.strip()
+    async for chunk in stream:
+        text = chunk.choices[0].delta.content
+        if text:
+            yield text
+
+async def process_question(question: str) -> AsyncIterator[Tuple[str, Any]]:
+    """Process a user question, yielding each stage of the answer as it is ready
 
-def process_question(question: str) -> Tuple[str, List[Dict], str]:
-    """Process user question and return SQL query, results, and natural language response"""
+    Yields ("note", text) first when a cached answer to a reworded question
+    is reused, then ("sql", query) once the SQL is generated, ("results",
+    (rows, truncated)) once it has run, then ("answer", text) for each chunk of the natural language
+    response streamed from Groq. The caller can render the SQL and results
+    while the answer is still being written. Blocking database work runs in
+    worker threads so the Groq calls never stall the event loop. Consume
+    from Streamlit inside asyncio.run().
+
+    Answers and generated SQL are cached per normalized question and schema,
+    so a repeated question skips both LLM calls and a schema change forces
+    fresh SQL. A question that differs from a cached one only in filler
+    words reuses its answer.
+    """
     # Get database schema context
-    schema_context = get_db_schema_context()
-    
-    # Generate SQL query
-    sql_query = generate_sql_query(question, schema_context)
+    schema_context = await get_db_schema_context()
+    cache_key = (
+        _canonicalize(question),
+        hashlib.sha256(schema_context.encode()).hexdigest(),
+    )
 
-    # Add validation
-    if not sql_query.lower().startswith(('select', 'insert', 'update', 'delete')):
-        st.error("Generated query appears invalid. Please check your question.")
-        return "", [], ""
+    cached_answer = _cache_get("answers", cache_key)
+    if not cached_answer:
+        similar = _similar_answer(cache_key)
+        if similar:
+            similar_question, cached_answer = similar
+            yield "note", f"Answer reused from the similar question “{similar_question}”."
+    if cached_answer:
+        sql_query, results, truncated, nl_response = cached_answer
+        yield "sql", sql_query
+        yield "results", (results, truncated)
+        if nl_response:
+            yield "answer", nl_response
+        return
     
-    # Execute query
-    results = execute_query(sql_query)
-    
-    # Generate natural language response
-    nl_response = generate_nl_response(question, sql_query, results)
-    
-    return sql_query, results, nl_response
\ No newline at end of file
+    client = get_groq()
+    parts = []
+    try:
+        # Generate SQL query
+        sql_query = _cache_get("sql", cache_key)
+        if not sql_query:
+            sql_query = await generate_sql_query(client, question, schema_context)
+
+        # Add validation
+        if not sql_query.lower().startswith(('select', 'insert', 'update', 'delete')):
+            st.error("Generated query appears invalid. Please check your question.")
+            return
+        yield "sql", sql_query
+        
+        # Execute query
+        results, _, truncated = await run_in_thread(execute_sql_query, sql_query)
+        yield "results", (results, truncated)
+        
+        # Generate natural language response
+        async for text in stream_nl_response(client, question, sql_query, results):
+            parts.append(text)
+            yield "answer", text
+    finally:
+        await client.close()
+
+    # An empty result may just be a failed query, so only keep real answers
+    if results:
+        _cache_put("sql", cache_key, sql_query)
+        _cache_put("answers", cache_key, (sql_query, results, truncated, "".join(parts).strip()))
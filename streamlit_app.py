@@ -1,21 +1,27 @@
-# import streamlit as st
-
-# st.title("🎈 My new app")
-# st.write(
-#     "Let's start building! For help and inspiration, head over to [docs.streamlit.io](https://docs.streamlit.io/)."
-# )
-
+import re
+import asyncio
 import streamlit as st
-import pandas as pd
+from src.concurrency import submit
 from src.database import (
     get_all_tables, 
-    get_table_schema, 
+    get_all_columns,
     get_table_relationships,
     get_database_stats,
-    get_table_preview,
-    get_database_name
+    get_previews,
+    get_database_name,
+    clear_schema_cache,
+    MAX_RESULT_ROWS
 )
-from src.llm_chain import process_question
+
+# Column names that hold money amounts
+_CURRENCY_RE = re.compile(r'(?:price|revenue|total|amount|value)', re.IGNORECASE)
+
+# Rows sent to the browser at once; larger results are paged with a slider
+MAX_DISPLAY_ROWS = 5000
+
+# Encoded CSV downloads kept in memory, and for how many seconds
+CSV_CACHE_ENTRIES = 8
+CSV_CACHE_TTL = 3600
 
 # Page configuration
 st.set_page_config(
@@ -24,65 +30,272 @@ st.set_page_config(
     layout="wide"
 )
 
-def format_currency(value):
-    """Format number as currency"""
+def build_results_frame(results):
+    """Convert result rows to an Arrow table and an Arrow-backed DataFrame
+
+    The table is None when Arrow cannot infer a column type (e.g. mixed
+    values) or infers one that does not display or export cleanly; the
+    DataFrame then falls back to pandas' own inference.
+    """
+    import pandas as pd
+    import pyarrow as pa
+    
     try:
-        if isinstance(value, (int, float)):
-            return f"${value:,.2f}"
-        return value
-    except:
-        return value
+        table = pa.Table.from_pylist(results)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return None, pd.DataFrame(results)
+    
+    # uuid becomes an Arrow extension type and arrays/JSON become nested
+    # types; st.dataframe cannot render those as ArrowDtype and the Arrow
+    # CSV writer rejects them
+    if any(
+        isinstance(field.type, pa.BaseExtensionType) or pa.types.is_nested(field.type)
+        for field in table.schema
+    ):
+        return None, pd.DataFrame(results)
+    
+    # Arrow-backed columns skip object inference and convert back to Arrow
+    # cheaply when st.dataframe serializes them
+    return table, table.to_pandas(types_mapper=pd.ArrowDtype)
 
-def main():
-    # Get database name
-    db_name = get_database_name()
+def currency_column_config(df):
+    """Column config showing numeric currency columns as dollars
+
+    Formatting happens in the browser, so the frame keeps its numeric values
+    and no display copy is needed.
+    """
+    import pandas as pd
+    
+    return {
+        col: st.column_config.NumberColumn(format="$%.2f")
+        for col in df.columns
+        if _CURRENCY_RE.search(col) and pd.api.types.is_numeric_dtype(df[col])
+    }
+
+def results_fingerprint(df):
+    """Cheap key identifying a result set, computed with vectorized hashing"""
+    import pandas as pd
+    
+    try:
+        row_hashes = pd.util.hash_pandas_object(df, index=False)
+    except (TypeError, ValueError, NotImplementedError):
+        # Array and JSON cells are unhashable; hash their text instead
+        row_hashes = pd.util.hash_pandas_object(df.astype(str), index=False)
+    return (df.shape, tuple(df.columns), int(row_hashes.sum()))
+
+@st.cache_data(show_spinner=False, max_entries=CSV_CACHE_ENTRIES, ttl=CSV_CACHE_TTL)
+def results_csv(fingerprint, _df, _table=None):
+    """Encode results as CSV once per distinct result set
+
+    _df and _table are left out of Streamlit's cache key; fingerprint stands
+    in for them. Arrow's C++ writer is used when the table is available.
+    """
+    if _table is not None:
+        import pyarrow as pa
+        import pyarrow.csv
+        
+        sink = pa.BufferOutputStream()
+        try:
+            pyarrow.csv.write_csv(_table, sink)
+            return sink.getvalue().to_pybytes()
+        except pa.ArrowException:
+            # Any type the Arrow writer does not support goes through pandas
+            pass
+    return _df.to_csv(index=False).encode('utf-8')
+
+async def show_results(slot, results, truncated=False):
+    """Render query results into a placeholder
+
+    truncated says execute_sql_query dropped rows past MAX_RESULT_ROWS.
+    """
+    if not results:
+        slot.info("No results found")
+        return
+    
+    # Build the frame on a worker thread while the answer streams in
+    table, df = await asyncio.to_thread(build_results_frame, results)
+    
+    container = slot.container()
+    
+    # Only ship one page of rows to the browser; the download has every row
+    # fetched, which execute_sql_query caps at MAX_RESULT_ROWS
+    view = df
+    if len(df) > MAX_DISPLAY_ROWS:
+        start = container.slider(
+            "Start row", 0, len(df) - MAX_DISPLAY_ROWS, key="result_start"
+        )
+        view = df.iloc[start:start + MAX_DISPLAY_ROWS]
+        container.caption(f"Displaying rows {start}-{start + len(view)} of {len(df):,}")
+    
+    # Display with currency columns formatted as dollars
+    container.dataframe(
+        view,
+        use_container_width=True,
+        hide_index=True,
+        column_config=currency_column_config(view)
+    )
+    
+    # Add download button, saying so when the fetch cap cut rows off
+    label = "📥 Download Results"
+    if truncated:
+        label += f" (first {MAX_RESULT_ROWS:,} rows)"
+    container.download_button(
+        label,
+        results_csv(results_fingerprint(df), df, table),
+        "query_results.csv",
+        "text/csv",
+        key='download-csv'
+    )
 
+def answer_slots():
+    """Lay out placeholders for a note, the SQL, results and answer"""
+    note_slot = st.empty()
+    
+    # Display results in columns
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.markdown("### Generated SQL")
+        sql_slot = st.empty()
+    
+    with col2:
+        st.markdown("### Results")
+        results_slot = st.empty()
+    
+    # Display natural language response
+    st.markdown("### Answer")
+    answer_slot = st.empty()
+    
+    return note_slot, sql_slot, results_slot, answer_slot
+
+async def render_stages(stages):
+    """Fill the answer placeholders as (stage, payload) pairs arrive"""
+    note_slot, sql_slot, results_slot, answer_slot = answer_slots()
+    sql_slot.caption("Generating SQL...")
+    
+    note, sql_query, results, truncated, nl_response = "", "", [], False, ""
+    results_task = None
+    async for stage, payload in stages:
+        if stage == "note":
+            note = payload
+            note_slot.info(note)
+        elif stage == "sql":
+            sql_query = payload
+            sql_slot.code(sql_query, language="sql")
+            results_slot.caption("Running query...")
+        elif stage == "results":
+            results, truncated = payload
+            # Build the table while the answer streams in
+            results_task = asyncio.create_task(show_results(results_slot, results, truncated))
+        elif stage == "answer":
+            nl_response += payload
+            answer_slot.markdown(nl_response)
+    
+    if results_task:
+        await results_task
+    elif not sql_query:
+        sql_slot.empty()
+    return note, sql_query, results, truncated, nl_response
+
+async def _replay(note, sql_query, results, truncated, nl_response):
+    """Yield a finished answer in the same stages process_question produces"""
+    if note:
+        yield "note", note
+    yield "sql", sql_query
+    yield "results", (results, truncated)
+    yield "answer", nl_response
+
+async def answer_question(question):
+    """Answer a question, showing the SQL, results and answer as each is ready"""
+    # The LLM client stack is only loaded once a question is asked
+    from src.llm_chain import process_question
+    
+    # A new result set starts paging from the top
+    st.session_state.pop("result_start", None)
+    answer = await render_stages(process_question(question))
+    
+    # Keep the answer so reruns (e.g. paging the results) can redraw it
+    _, sql_query, *_ = answer
+    if sql_query:
+        st.session_state["last_answer"] = answer
+    else:
+        st.session_state.pop("last_answer", None)
+
+def main():
     st.title("SQL Query Assistant 🤖")
     
     # Sidebar - Database Schema Information
     with st.sidebar:
-        st.header(f"{db_name} Schema")
+        header_slot = st.empty()
+
+        # Drop cached schema, stats and samples so outside changes show up
+        if st.button("🔄 Refresh schema"):
+            clear_schema_cache()
+    
+    # Start the sidebar lookups together so a cold load waits for the slowest
+    # one, not their sum
+    stats_future = submit(get_database_stats)
+    tables_future = submit(get_all_tables)
+    columns_future = submit(get_all_columns)
+    relationships_future = submit(get_table_relationships)
+    
+    # Get database name; it only reads st.secrets
+    db_name = get_database_name()
+    
+    with st.sidebar:
+        header_slot.header(f"{db_name} Schema")
         #st.header("Database Schema")
         
         # Add database statistics
-        stats = get_database_stats()
+        stats = stats_future.result()
         if stats:
-            st.write("📊 **Database Statistics**")
-            col1, col2 = st.columns(2)
-            with col1:
-                st.metric("Tables", stats["tables"])
-                st.metric("Total Rows", f"{stats['total_rows']:,}")
-            with col2:
-                st.metric("Database Size", stats["size"])
+            # One markdown element instead of a column layout and three metrics
+            st.markdown(
+                "📊 **Database Statistics**\n\n"
+                "<div style='display:flex;flex-wrap:wrap;gap:1.5rem'>"
+                f"<div><small>Tables</small><br><b>{stats['tables']}</b></div>"
+                f"<div><small>Total Rows (est.)</small><br><b>{stats['total_rows']:,}</b></div>"
+                f"<div><small>Database Size</small><br><b>{stats['size']}</b></div>"
+                "</div>",
+                unsafe_allow_html=True
+            )
         
         st.divider()
         
-        # Get all tables
-        tables = get_all_tables()
+        # Get all tables and their columns
+        tables = tables_future.result()
+        all_columns = columns_future.result()
+        
+        # Sample rows are only fetched for tables the user asked to preview
+        opened = st.session_state.setdefault("preview_tables", [])
+        previews = get_previews([t for t in tables if t in opened], limit=3)
         
         # Create expanders for each table
         for table in tables:
             with st.expander(f"📋 {table}"):
                 # Show column information
-                columns = get_table_schema(table)
                 st.write("**Columns:**")
-                for col in columns:
-                    col_name, col_type, is_nullable, default = col
-                    nullable_text = "NULL" if is_nullable == "YES" else "NOT NULL"
-                    st.text(f"▫️ {col_name} ({col_type}) {nullable_text}")
+                # One element for the whole list instead of one per column
+                st.code("\n".join(
+                    f"▫️ {col_name} ({col_type}) {'NULL' if is_nullable == 'YES' else 'NOT NULL'}"
+                    for col_name, col_type, is_nullable, default in all_columns.get(table, [])
+                ), language=None)
                 
                 # Show sample data
                 st.write("**Sample Data:**")
-                preview = get_table_preview(table, limit=3)
-                if preview:
-                    df_preview = pd.DataFrame(preview)
-                    st.dataframe(df_preview, use_container_width=True)
+                if table not in opened:
+                    st.button("Load", key=f"load_{table}", on_click=opened.append, args=(table,))
+                elif previews.get(table):
+                    # st.dataframe takes the row dicts as-is
+                    st.dataframe(previews[table], use_container_width=True)
         
         # Show relationships in a separate expander
         with st.expander("🔗 Table Relationships"):
-            relationships = get_table_relationships()
-            for rel in relationships:
-                st.text(f"{rel[1]}.{rel[2]} ➜ {rel[4]}.{rel[5]}")
+            relationships = relationships_future.result()
+            if relationships:
+                st.code("\n".join(
+                    f"{rel[1]}.{rel[2]} ➜ {rel[4]}.{rel[5]}" for rel in relationships
+                ), language=None)
     
     # Main area
     #st.write("### Ask questions about your database")
@@ -94,61 +307,25 @@ def main():
     - List top 5 customers by order value
     """)
     
-    # User input
-    user_question = st.text_input("Enter your question:")
+    # User input; the form only reruns the script when it is submitted
+    with st.form("ask"):
+        user_question = st.text_input("Enter your question:")
+        
+        col_ask, col_refresh = st.columns([1, 6])
+        with col_ask:
+            get_answer = st.form_submit_button("Get Answer", type="primary")
+        with col_refresh:
+            # Re-run the query and summary instead of serving a cached answer
+            force_refresh = st.form_submit_button("Force refresh")
     
-    if st.button("Get Answer", type="primary"):
+    if get_answer or force_refresh:
+        if force_refresh:
+            from src.llm_chain import clear_response_cache
+            clear_response_cache()
         if user_question:
-            with st.spinner("Processing your question..."):
-                # Process the question
-                sql_query, results, nl_response = process_question(user_question)
-                
-                # Display results in columns
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.markdown("### Generated SQL")
-                    st.code(sql_query, language="sql")
-                
-                with col2:
-                    st.markdown("### Results")
-                    if results:
-                        # Convert results to DataFrame
-                        df = pd.DataFrame(results)
-                        
-                        # Format currency columns
-                        currency_columns = [col for col in df.columns 
-                                         if any(x in col.lower() for x in 
-                                              ['price', 'revenue', 'total', 'amount', 'value'])]
-                        
-                        # Create a copy for display
-                        df_display = df.copy()
-                        
-                        # Format currency columns
-                        for col in currency_columns:
-                            df_display[col] = df[col].apply(format_currency)
-                        
-                        # Display as a styled table
-                        st.dataframe(
-                            df_display,
-                            use_container_width=True,
-                            hide_index=True
-                        )
-                        
-                        # Add download button
-                        st.download_button(
-                            "📥 Download Results",
-                            df.to_csv(index=False).encode('utf-8'),
-                            "query_results.csv",
-                            "text/csv",
-                            key='download-csv'
-                        )
-                    else:
-                        st.info("No results found")
-                
-                # Display natural language response
-                st.markdown("### Answer")
-                st.write(nl_response)
+            asyncio.run(answer_question(user_question))
+    elif "last_answer" in st.session_state:
+        asyncio.run(render_stages(_replay(*st.session_state["last_answer"])))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file